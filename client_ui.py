@@ -1,17 +1,25 @@
 import streamlit as st
 import os
 import asyncio
+import atexit
+import base64
 import json
-import tempfile
+import queue
+import threading
 
+import anyio
 from dotenv import load_dotenv
 from mcp import ClientSession
 from mcp.client.sse import sse_client
+from mcp.shared.exceptions import McpError
+from mcp.types import CONNECTION_CLOSED
 from langchain_mcp_adapters.tools import load_mcp_tools
-from langgraph.prebuilt import create_react_agent
+from langgraph.prebuilt import ToolNode, create_react_agent
+from langgraph.prebuilt.tool_node import TOOL_CALL_ERROR_TEMPLATE
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.memory import ConversationSummaryBufferMemory
-from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.messages import AIMessageChunk, HumanMessage, SystemMessage
+
+from summary_memory import ReceiptSummaryMemory, retrieve
 
 # =========================================================
 # SETUP
@@ -25,56 +33,316 @@ llm = ChatGoogleGenerativeAI(
     google_api_key=os.getenv("GOOGLE_API_KEY"),
 )
 
-memory = ConversationSummaryBufferMemory(
-    llm=llm, return_messages=True, max_token_limit=1000
+SYSTEM_MSG = SystemMessage(
+    content=(
+        "You are an Expense Tracking Assistant. "
+        "Your job is to process receipt images, extract their text using the OCR tool, "
+        "convert the text into structured JSON with fields: vendor, date, total_amount, and line_items, "
+        "categorize each item using the available categories, and append the structured result into Google Sheets. "
+        "\n\n"
+        "Always use the provided MCP tools for: \n"
+        "- `extract_and_structure` → to OCR a receipt image straight into structured, categorized JSON (preferred)\n"
+        "- `extract_receipt_text` → to OCR the receipt image\n"
+        "- `extract_receipt_text_batch` → to OCR several receipt images at once\n"
+        "- `structure_receipt_text` → to turn raw text into structured JSON\n"
+        "- `structure_receipt_text_batch` → to structure several raw texts at once\n"
+        "- `append_to_sheet` → to save structured data into Google Sheets\n"
+        "- `append_to_sheet_batch` → to save several structured receipts in one request\n"
+        "- `add_category` / `remove_category` → to manage spending categories\n"
+        "- `batch` → to run independent tool calls concurrently\n\n"
+
+        "For a receipt image, call `extract_and_structure` and pass its output to `append_to_sheet`; "
+        "only fall back to `extract_receipt_text` + `structure_receipt_text` if it returns an error. "
+        "If the query already contains a structured receipt, do not OCR or structure it again: "
+        "pass it to `append_to_sheet` as-is. "
+        "When several receipts need processing, emit one `batch` call with one `extract_and_structure` "
+        "invocation per image (or call `extract_receipt_text_batch` followed by "
+        "`structure_receipt_text_batch` for raw text) "
+        "instead of calling the tools one image at a time, "
+        "then save all results with a single `append_to_sheet_batch` call. "
+
+        "Dates should be in DD/MM/YYYY format when possible. "
+        "Keep vendor names short and consistent. "
+        "Be robust to noisy OCR text. "
+        "If categories do not match exactly, choose the closest one or ask the user to add a new one."
+    )
 )
 
+# Kept in session_state so the conversation survives Streamlit reruns.
+if "memory" not in st.session_state:
+    st.session_state["memory"] = ReceiptSummaryMemory(
+        llm=llm, return_messages=True, max_token_limit=1000
+    )
+memory = st.session_state["memory"]
+
+
+# One event loop per process, running in a daemon thread. Streamlit reruns
+# this script on every interaction, so it is created through cache_resource
+# to keep the cached MCP session and HTTP pools bound to a loop that stays alive.
+@st.cache_resource
+def get_event_loop():
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True, name="mcp-event-loop").start()
+    return loop
+
+
+loop = get_event_loop()
+
+
+def run_async(coro):
+    """Run a coroutine on the background event loop and wait for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+def stream_async(agen):
+    """
+    Consume an async generator on the background event loop and yield its
+    items synchronously, e.g. for `st.write_stream`.
+    """
+    items = queue.Queue()
+    done = object()
+
+    async def pump():
+        try:
+            async for item in agen:
+                items.put(item)
+        except Exception as e:
+            items.put(e)
+        finally:
+            items.put(done)
+
+    asyncio.run_coroutine_threadsafe(pump(), loop)
+    while (item := items.get()) is not done:
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+# =========================================================
+# HELPER: Cached MCP session + agent
+# =========================================================
+MCP_SSE_URL = "http://127.0.0.1:8000/sse"
+
+# Errors meaning the SSE transport is gone (e.g. the MCP server restarted).
+TRANSPORT_ERRORS = (
+    anyio.ClosedResourceError,
+    anyio.BrokenResourceError,
+    anyio.EndOfStream,
+    ConnectionError,
+)
+
+
+def is_transport_error(exc: BaseException) -> bool:
+    if isinstance(exc, BaseExceptionGroup):
+        return any(is_transport_error(e) for e in exc.exceptions)
+    while exc is not None:
+        if isinstance(exc, TRANSPORT_ERRORS):
+            return True
+        # requests still pending when the stream drops fail with this
+        if isinstance(exc, McpError) and exc.error.code == CONNECTION_CLOSED:
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+def handle_tool_error(e: Exception) -> str:
+    """
+    ToolNode error handler: report tool failures back to the model as usual,
+    but re-raise transport errors so the turn fails and the caller reconnects
+    instead of the agent retrying against a dead session.
+    """
+    if is_transport_error(e):
+        raise e
+    return TOOL_CALL_ERROR_TEMPLATE.format(error=repr(e))
+
+
+def _teardown_mcp_connection(state: dict):
+    conn = state.get("conn")
+    if conn is None:
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(close_mcp_connection(conn), loop).result(timeout=10)
+    except Exception as e:
+        print(f"Failed to close MCP session: {e}")
+
+
+# Shared by every browser session in this process, like the event loop: the
+# SSE connection, tool list and compiled agent graph are built once and survive
+# Streamlit reruns. A plain dict is used so the coroutines below never touch
+# Streamlit state directly. Conversation memory stays per session.
+@st.cache_resource
+def get_mcp_state():
+    state = {"lock": asyncio.Lock()}
+    atexit.register(_teardown_mcp_connection, state)
+    return state
+
+
+mcp_state = get_mcp_state()
+
+
+async def _hold_mcp_connection(conn: dict, ready: asyncio.Future):
+    """
+    Own the SSE client and MCP session for their whole lifetime, so both are
+    entered and exited in this one task, until `conn["closing"]` is set.
+    The SSE reader reports a dropped stream to the session's message handler,
+    which sets it too, so the task also returns when the server goes away.
+    """
+    async def on_message(message):
+        if isinstance(message, Exception):
+            conn["closing"].set()
+
+    try:
+        async with sse_client(MCP_SSE_URL) as (read, write):
+            async with ClientSession(read, write, message_handler=on_message) as session:
+                await session.initialize()
+                tools = await load_mcp_tools(session)
+                conn.update(
+                    session=session,
+                    tools=tools,
+                    agent=create_react_agent(
+                        llm, ToolNode(tools, handle_tool_errors=handle_tool_error)
+                    ),
+                )
+                ready.set_result(conn)
+                await conn["closing"].wait()
+    except Exception as e:
+        if not ready.done():
+            ready.set_exception(e)
+        else:
+            print(f"MCP session closed with error: {e}")
+    finally:
+        if not ready.done():
+            ready.cancel()
+
+
+async def close_mcp_connection(conn: dict):
+    conn["closing"].set()
+    await asyncio.wait([conn["task"]], timeout=5)
+
+
+async def get_connection(state: dict) -> dict:
+    """
+    Return the cached MCP connection ({"session", "tools", "agent", ...}),
+    opening the SSE connection, initializing the session, loading tools and
+    compiling the agent graph on first use.
+
+    `_hold_mcp_connection` returns once the SSE stream drops, so a cached
+    connection whose task is done is dead and gets rebuilt.
+    """
+    async with state["lock"]:
+        conn = state.get("conn")
+        if conn is not None and conn["task"].done():
+            del state["conn"]
+            await close_mcp_connection(conn)
+        if state.get("conn") is None:
+            conn = {"closing": asyncio.Event()}
+            ready = asyncio.get_running_loop().create_future()
+            conn["task"] = asyncio.create_task(_hold_mcp_connection(conn, ready))
+            await ready
+            state["conn"] = conn
+        return state["conn"]
+
+
+async def reset_connection(state: dict, conn: dict):
+    """
+    Forget a broken connection and close it, so the next call reconnects.
+    The connection is shared by every browser session, so it is only dropped
+    if it is still the cached one; a session that hit the same dead
+    connection later must not tear down the replacement another one built.
+    """
+    async with state["lock"]:
+        if state.get("conn") is conn:
+            del state["conn"]
+    await close_mcp_connection(conn)
+
+
+async def with_reconnect(state: dict, fn):
+    """
+    Await `fn(conn)` on the cached connection; on a transport error, reconnect
+    once and retry.
+    """
+    conn = await get_connection(state)
+    try:
+        return await fn(conn)
+    except Exception as e:
+        if not is_transport_error(e):
+            raise
+        await reset_connection(state, conn)
+        return await fn(await get_connection(state))
+
+
+async def extract_uploaded_receipt(image_b64: str) -> str:
+    """
+    OCR and structure an in-memory receipt in one Gemini call by invoking the
+    `extract_and_structure_bytes` MCP tool directly on the cached session, so
+    the image never passes through the LLM.
+    """
+    result = await with_reconnect(
+        mcp_state,
+        lambda conn: conn["session"].call_tool(
+            "extract_and_structure_bytes", {"image_b64": image_b64}
+        ),
+    )
+    return "\n".join(c.text for c in result.content if getattr(c, "text", None))
+
+
+def upload_error(receipt_json: str) -> str | None:
+    """Return why `extract_uploaded_receipt` failed, or None if it produced a receipt."""
+    if not receipt_json.strip():
+        return "no receipt was detected"
+    try:
+        receipt = json.loads(receipt_json)
+    except ValueError:
+        return "the response was not valid JSON"
+    if isinstance(receipt, dict) and "error" in receipt:
+        return receipt["error"]
+    return None
+
+
 # =========================================================
 # HELPER: Run agent with query
 # =========================================================
 async def run_agent_with_query(query: str):
-    async with sse_client("http://127.0.0.1:8000/sse") as (read, write):
-        async with ClientSession(read, write) as session:
-            await session.initialize()
-            tools = await load_mcp_tools(session)
-            agent = create_react_agent(llm, tools)
-
-            memory.chat_memory.add_message(SystemMessage(
-                content=(
-                    "You are an Expense Tracking Assistant. "
-                    "Your job is to process receipt images, extract their text using the OCR tool, "
-                    "convert the text into structured JSON with fields: vendor, date, total_amount, and line_items, "
-                    "categorize each item using the available categories, and append the structured result into Google Sheets. "
-                    "\n\n"
-                    "Always use the provided MCP tools for: \n"
-                    "- `extract_receipt_text` → to OCR the receipt image\n"
-                    "- `structure_receipt_text` → to turn raw text into structured JSON\n"
-                    "- `append_to_sheet` → to save structured data into Google Sheets\n"
-                    "- `add_category` / `remove_category` → to manage spending categories\n\n"
-                    
-                    "Dates should be in DD/MM/YYYY format when possible. "
-                    "Keep vendor names short and consistent. "
-                    "Be robust to noisy OCR text. "
-                    "If categories do not match exactly, choose the closest one or ask the user to add a new one."
-                )
-                ))
-            past_messages = memory.load_memory_variables({})["history"]
-            response = await agent.ainvoke(
-                {"messages": past_messages + [HumanMessage(content=query)]}
-            )
-            print(str(response["messages"][2].content))
-            return str(response["messages"][2].content)
-            # ✅ Extract last AIMessage only
-            # if isinstance(response, list):
-            #     ai_messages = [m for m in response if m.__class__.__name__ == "AIMessage"]
-            #     if ai_messages:
-            #         print("I am here")
-            #         return ai_messages[-1].content
-                
-            # if hasattr(response, "content"):
-            #     return response.content
-
-            # return str(response)  # fallback
+    """
+    Run the agent on `query`, yielding the assistant's text as it is generated.
+
+    Each LLM step (e.g. a note before a tool call, then the final reply) is a
+    separate message; their texts are streamed separated by a blank line, and
+    only the final step's text is saved to memory as the answer.
+    """
+    if not any(isinstance(m, SystemMessage) for m in memory.chat_memory.messages):
+        memory.chat_memory.add_message(SYSTEM_MSG)
+
+    past_messages = retrieve(query, memory.load_memory_variables({})["history"])
+    steps = {}  # message id -> text chunks, in streaming order
+    for attempt in range(2):
+        conn = await get_connection(mcp_state)
+        try:
+            async for chunk, _ in conn["agent"].astream(
+                {"messages": past_messages + [HumanMessage(content=query)]},
+                stream_mode="messages",
+            ):
+                if isinstance(chunk, AIMessageChunk) and isinstance(chunk.content, str) and chunk.content:
+                    if chunk.id not in steps:
+                        if steps:
+                            yield "\n\n"
+                        steps[chunk.id] = []
+                    steps[chunk.id].append(chunk.content)
+                    yield chunk.content
+            break
+        except Exception as e:
+            if not is_transport_error(e):
+                raise
+            # drop the dead connection either way, so the next turn reconnects,
+            # but only retry if none of the answer was streamed yet
+            await reset_connection(mcp_state, conn)
+            if attempt or steps:
+                raise
+
+    answer = "".join(list(steps.values())[-1]) if steps else ""
+    # save_context may summarize through a blocking LLM call; keep it off the loop
+    await asyncio.to_thread(
+        memory.save_context, {"input": query}, {"output": answer}
+    )
 
 
 # =========================================================
@@ -87,6 +355,10 @@ st.title("🧾 Receipt Chatbot")
 if "messages" not in st.session_state:
     st.session_state["messages"] = []
 
+# file_ids of uploads already sent to the agent
+if "attached_uploads" not in st.session_state:
+    st.session_state["attached_uploads"] = set()
+
 # Display chat history
 for msg in st.session_state["messages"]:
     role, content = msg
@@ -103,20 +375,24 @@ if prompt := st.chat_input("Type your query here..."):
     with st.chat_message("user"):
         st.markdown(prompt)
 
-    # If image uploaded, save temporarily and include its path in the query
-    if uploaded_file is not None:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
-            tmp.write(uploaded_file.read())
-            image_path = tmp.name
-        query = f"{prompt}\nReceipt path: {image_path}"
-    else:
-        query = prompt
-
     # Run agent
     with st.chat_message("assistant"):
         with st.spinner("Thinking..."):
-            final_output = asyncio.run(run_agent_with_query(query))
-            st.markdown(final_output)
+            # file_uploader keeps the file across messages, so each upload is
+            # extracted and attached to the query only once
+            query = prompt
+            if uploaded_file is not None and uploaded_file.file_id not in st.session_state["attached_uploads"]:
+                img_b64 = base64.b64encode(uploaded_file.getvalue()).decode()
+                receipt_json = run_async(extract_uploaded_receipt(img_b64))
+                error = upload_error(receipt_json)
+                if error:
+                    # not marked as attached, so the next message retries it
+                    st.warning(f"Could not read the uploaded receipt: {error}")
+                else:
+                    st.session_state["attached_uploads"].add(uploaded_file.file_id)
+                    query = f"{prompt}\nStructured receipt: {receipt_json}"
+
+        final_output = st.write_stream(stream_async(run_agent_with_query(query)))
 
     st.session_state["messages"].append(("assistant", final_output))
 
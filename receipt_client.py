@@ -9,9 +9,10 @@ from mcp.client.sse import sse_client
 from langchain_mcp_adapters.tools import load_mcp_tools
 from langgraph.prebuilt import create_react_agent
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.memory import ConversationSummaryBufferMemory
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 
+from summary_memory import ReceiptSummaryMemory
+
 load_dotenv()
 
 # ---------------------------
@@ -33,7 +34,7 @@ llm = ChatGoogleGenerativeAI(
     google_api_key=os.getenv("GOOGLE_API_KEY"),
 )
 
-memory = ConversationSummaryBufferMemory(
+memory = ReceiptSummaryMemory(
     llm=llm, return_messages=True, max_token_limit=1000
 )
 
@@ -54,14 +55,17 @@ async def run_agent():
                 if query.lower() == "quit" or query.lower() == "exit":
                     break
 
-                memory.chat_memory.add_message(HumanMessage(content=query))
                 past_messages = memory.load_memory_variables({})["history"]
 
                 response = await agent.ainvoke(
                     {"messages": past_messages + [HumanMessage(content=query)]}
                 )
 
-                memory.chat_memory.add_message(AIMessage(content=str(response)))
+                # Only the final answer goes into memory; the full trajectory is for display
+                ai_text = response["messages"][-1].content
+                memory.chat_memory.add_message(HumanMessage(content=query))
+                memory.chat_memory.add_message(AIMessage(content=ai_text))
+                memory.prune()
                 try:
                     formatted = json.dumps(response, indent=2, cls=CustomEncoder)
                 except Exception:
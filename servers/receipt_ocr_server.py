@@ -1,13 +1,23 @@
 # receipt_ocr_server.py
 import os
-import json
+import orjson
+import asyncio
 import base64
+import hashlib
+import functools
+import tempfile
+import threading
+import cv2
+import numpy as np
+from pydantic import BaseModel, ValidationError
 from mcp.server.fastmcp import FastMCP
 from dotenv import load_dotenv
 import google.generativeai as genai
 
 #google sheets imports
+import httplib2
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
@@ -22,6 +32,8 @@ mcp = FastMCP("receipt-ocr")
 DEFAULT_HOME = os.path.expanduser("~")
 DEFAULT_WORKSPACE = os.path.join(DEFAULT_HOME, "receipt-ocr", "workspace")
 os.makedirs(DEFAULT_WORKSPACE, exist_ok=True)
+OCR_CACHE_DIR = os.path.join(DEFAULT_WORKSPACE, "ocr_cache")
+os.makedirs(OCR_CACHE_DIR, exist_ok=True)
 
 # ==================================================
 # GEMINI CONFIG
@@ -38,6 +50,9 @@ model = genai.GenerativeModel("gemini-1.5-flash")
 # ============================================================
 CATEGORIES_FILE = os.path.join(DEFAULT_WORKSPACE, "categories.json")
 
+# Parsed categories.json, reloaded only when the file's mtime changes.
+_CAT_CACHE = {"mtime": None, "data": None}
+
 def load_categories():
     if not os.path.exists(CATEGORIES_FILE):
         # create default
@@ -48,30 +63,191 @@ def load_categories():
                 "Beverages", "Bakery"
             ]
         }
-        with open(CATEGORIES_FILE, "w") as f:
-            json.dump(default, f, indent=2)
+        with open(CATEGORIES_FILE, "wb") as f:
+            f.write(orjson.dumps(default, option=orjson.OPT_INDENT_2))
         return default["categories"]
 
-    with open(CATEGORIES_FILE, "r") as f:
-        data = json.load(f)
-        return data.get("categories", [])
+    mtime = os.path.getmtime(CATEGORIES_FILE)
+    if mtime != _CAT_CACHE["mtime"]:
+        with open(CATEGORIES_FILE, "rb") as f:
+            _CAT_CACHE["data"] = orjson.loads(f.read())
+        _CAT_CACHE["mtime"] = mtime
+    # callers mutate the returned list before saving, so hand out a copy
+    return list(_CAT_CACHE["data"].get("categories", []))
 
 def save_categories(categories):
-    with open(CATEGORIES_FILE, "w") as f:
-        json.dump({"categories": categories}, f, indent=2)
+    with open(CATEGORIES_FILE, "wb") as f:
+        f.write(orjson.dumps({"categories": categories}, option=orjson.OPT_INDENT_2))
+    _CAT_CACHE["mtime"] = None
 # =================================================
 # HELPERS
 # ===========================================================
-def load_image_as_base64(image_path: str) -> str:
+def load_image_bytes(image_path: str) -> bytes:
     """
-    Read an image file from disk and return its contents as a Base64-encoded string.
+    Read an image file from disk as raw bytes.
     Args:
         image_path (str): Absolute or relative path to the image file (e.g. .jpg, .png).
     Returns:
-        str: Base64-encoded representation of the image, ready to be passed into Gemini OCR.
+        bytes: The file contents, ready to be passed into Gemini OCR as part `data`.
+    Notes:
+        - Gemini accepts raw bytes for inline image data, so no Base64 copy of
+          the image is ever built; peak memory is a single copy of the file.
     """
     with open(image_path, "rb") as f:
-        return base64.b64encode(f.read()).decode("utf-8")
+        return f.read()
+
+# Longest image side sent to Gemini after preprocessing.
+MAX_OCR_SIDE = 2000
+# Larger detected skews on phone photos are more likely background edges than tilted text.
+MAX_DESKEW_ANGLE = 15
+
+def deskew(img):
+    """
+    Rotate a grayscale receipt image so its text lines are horizontal.
+    Args:
+        img: Grayscale image as a NumPy array.
+    Returns:
+        The rotated image, or `img` unchanged if no skew (or an implausibly
+        large one, above MAX_DESKEW_ANGLE degrees) is detected.
+    """
+    mask = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
+    coords = cv2.findNonZero(mask)
+    if coords is None:
+        return img
+    # minAreaRect returns (0, 90] in OpenCV 4 and [-90, 0) in OpenCV 5;
+    # fold either convention into [-45, 45)
+    angle = (cv2.minAreaRect(coords)[-1] + 45) % 90 - 45
+    if abs(angle) < 0.5 or abs(angle) > MAX_DESKEW_ANGLE:
+        return img
+    h, w = img.shape[:2]
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(
+        img, matrix, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE
+    )
+
+def binarize_for_ocr(img) -> bytes | None:
+    """
+    Clean up a grayscale receipt photo for OCR: downscale, deskew and adaptive threshold.
+    Args:
+        img: Grayscale image as a NumPy array.
+    Returns:
+        bytes | None: PNG of the binarized image, or None if encoding fails.
+    Notes:
+        - The binarized PNG is typically much smaller than the original photo,
+          which cuts upload size and vision tokens billed by Gemini.
+    """
+    scale = MAX_OCR_SIDE / max(img.shape[:2])
+    if scale < 1:
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    img = deskew(img)
+    img = cv2.adaptiveThreshold(
+        img, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 10
+    )
+    ok, buf = cv2.imencode(".png", img)
+    if not ok:
+        return None
+    return buf.tobytes()
+
+def preprocess(image_path: str) -> bytes | None:
+    """
+    Load a receipt image from disk and binarize it for OCR (see `binarize_for_ocr`).
+    Args:
+        image_path (str): Absolute or relative path to the image file (e.g. .jpg, .png).
+    Returns:
+        bytes | None: Binarized PNG, or None if OpenCV cannot decode the file.
+    """
+    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+    return binarize_for_ocr(img)
+
+def preprocess_bytes(data: bytes) -> bytes | None:
+    """
+    Decode an in-memory receipt image and binarize it for OCR (see `binarize_for_ocr`).
+    Args:
+        data (bytes): Encoded image contents (e.g. JPEG/PNG).
+    Returns:
+        bytes | None: Binarized PNG, or None if OpenCV cannot decode the bytes.
+    """
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+    return binarize_for_ocr(img)
+
+def load_image_part(image_path: str) -> dict:
+    """
+    Build the Gemini image part for a receipt, preferring the preprocessed PNG.
+    Args:
+        image_path (str): Absolute or relative path to the image file (e.g. .jpg, .png).
+    Returns:
+        dict: {"mime_type": ..., "data": <bytes>} ready to be passed into Gemini OCR.
+    """
+    png = preprocess(image_path)
+    if png is not None:
+        return {"mime_type": "image/png", "data": png}
+    return {"mime_type": "image/jpeg", "data": load_image_bytes(image_path)}
+
+def load_image_bytes_part(data: bytes) -> dict:
+    """
+    Same as `load_image_part`, for image contents already held in memory.
+    """
+    png = preprocess_bytes(data)
+    if png is not None:
+        return {"mime_type": "image/png", "data": png}
+    return {"mime_type": "image/jpeg", "data": data}
+
+def file_sha256(path: str) -> str:
+    """Return the SHA-256 hex digest of a file's contents."""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+def read_ocr_cache(digest: str) -> str | None:
+    """Return the cached OCR JSON for an image digest, or None if it was never extracted."""
+    cache_path = os.path.join(OCR_CACHE_DIR, digest + ".json")
+    if not os.path.exists(cache_path):
+        return None
+    with open(cache_path, "r") as f:
+        return f.read()
+
+def write_ocr_cache(digest: str, result: str):
+    # write to a temp file and rename it into place, so a crash mid-write
+    # cannot leave a truncated entry that is then served forever
+    fd, tmp_path = tempfile.mkstemp(dir=OCR_CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(result)
+        os.replace(tmp_path, os.path.join(OCR_CACHE_DIR, digest + ".json"))
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+async def ocr_with_cache(digest: str, build_image_part) -> str:
+    """
+    OCR a receipt with Gemini unless its result is already cached.
+    Args:
+        digest (str): SHA-256 hex digest of the original image contents.
+        build_image_part: Zero-argument callable returning the Gemini image part;
+                          it runs in a worker thread and only on a cache miss.
+    Returns:
+        str (JSON): {"raw_text": ...}
+    Notes:
+        - Only non-empty results are cached.
+    """
+    cached = read_ocr_cache(digest)
+    if cached is not None:
+        return cached
+
+    image_part = await asyncio.to_thread(build_image_part)
+    response = await asyncio.to_thread(model.generate_content, [
+        image_part,
+        {"text": "Extract all text from this receipt."}
+    ])
+    raw_text = parse_response(response)
+    result = orjson.dumps({"raw_text": raw_text}, option=orjson.OPT_INDENT_2).decode()
+    # an empty result (e.g. a blocked response) must stay retryable
+    if raw_text:
+        write_ocr_cache(digest, result)
+    return result
 
 def parse_response(response) -> str:
     """
@@ -95,15 +271,130 @@ def parse_response(response) -> str:
                     text_parts.append(part.text)
     return "\n".join(text_parts)
 
+class LineItem(BaseModel):
+    item: str
+    price: float
+    category: str
+
+class Receipt(BaseModel):
+    vendor: str
+    date: str
+    total_amount: float | None = None
+    line_items: list[LineItem]
+
+# Gemini response schema matching `Receipt`. Spelled out as a dict because
+# google.generativeai drops `required` when converting pydantic models and
+# rejects fields with defaults.
+RECEIPT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "vendor": {"type": "string"},
+        "date": {"type": "string"},
+        "total_amount": {"type": "number", "nullable": True},
+        "line_items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "item": {"type": "string"},
+                    "price": {"type": "number"},
+                    "category": {"type": "string"},
+                },
+                "required": ["item", "price", "category"],
+            },
+        },
+    },
+    "required": ["vendor", "date", "total_amount", "line_items"],
+}
+
+# Makes Gemini return JSON that matches `Receipt` instead of free-form text.
+RECEIPT_JSON_CONFIG = {"response_mime_type": "application/json", "response_schema": RECEIPT_SCHEMA}
+
+STRUCTURE_PROMPT = """
+I have the following spending categories:
+{categories}
+
+For each line item, classify it into the most appropriate category.
+Return JSON with:
+- vendor
+- date
+- total_amount
+- line_items: list of objects with 'item', 'price', 'category'
+"""
+
+async def structure_image_with_cache(digest: str, build_image_part) -> str:
+    """
+    OCR, structure and categorize a receipt image in one Gemini call, unless
+    the result is already cached.
+    Args:
+        digest (str): SHA-256 hex digest of the original image contents.
+        build_image_part: Zero-argument callable returning the Gemini image part;
+                          it runs in a worker thread and only on a cache miss.
+    Returns:
+        str: Gemini's JSON response text, matching the `Receipt` schema.
+    Notes:
+        - Results depend on the categories too, so they are cached under a key
+          derived from the image digest and the current categories, next to
+          the OCR cache entries.
+        - Only non-empty results are cached.
+    """
+    categories = load_categories()
+    cache_key = hashlib.sha256(orjson.dumps([digest, categories])).hexdigest()
+    cached = read_ocr_cache(cache_key)
+    if cached is not None:
+        return cached
+
+    image_part = await asyncio.to_thread(build_image_part)
+    prompt = "Here is a receipt image.\n" + STRUCTURE_PROMPT.format(categories=categories)
+    response = await asyncio.to_thread(
+        model.generate_content,
+        [image_part, {"text": prompt}],
+        generation_config=RECEIPT_JSON_CONFIG,
+    )
+    result = parse_response(response)
+    # an empty result (e.g. a blocked response) must stay retryable
+    if result:
+        write_ocr_cache(cache_key, result)
+    return result
+
+@functools.lru_cache(maxsize=128)
+def structure_with_categories(raw_text: str, categories: tuple[str, ...]) -> str:
+    """
+    Ask Gemini to turn receipt OCR text into categorized JSON.
+    Args:
+        raw_text (str): Plain text extracted from the receipt.
+        categories (tuple[str, ...]): Current spending categories (hashable, for the LRU cache).
+    Returns:
+        str: Gemini's JSON response text, matching the `Receipt` schema.
+             Identical inputs are served from the cache.
+    Raises:
+        ValueError: If Gemini returned no text (e.g. a blocked response).
+                    Raising keeps the failure out of the LRU cache, so the
+                    same text can be retried.
+    """
+    response = model.generate_content(
+        f"Here is a receipt OCR text:\n\n{raw_text}\n"
+        + STRUCTURE_PROMPT.format(categories=list(categories)),
+        generation_config=RECEIPT_JSON_CONFIG,
+    )
+    result = parse_response(response)
+    if not result:
+        raise ValueError("Gemini returned an empty response")
+    return result
+
 # =========================================================
 # GOOGLE SHEETS TOOLING
 # ==================================================
 SHEETS_SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 SPREADSHEET_ID = os.environ.get("SHEETS_ID")  # put your target sheet ID in .env
+SHEETS_HTTP_TIMEOUT = 30  # seconds
 
 class SheetsTool:
     def __init__(self):
         self.service = None
+        # The tools call this from worker threads, but the shared httplib2.Http
+        # is not thread-safe, so auth and appends run one at a time.
+        self._lock = threading.Lock()
 
     def auth(self):
         creds = None
@@ -124,7 +415,10 @@ class SheetsTool:
             with open("token.json", "w") as token:
                 token.write(creds.to_json())
 
-        self.service = build("sheets", "v4", credentials=creds)
+        # One long-lived authorized Http object: it keeps the TLS connection to
+        # the Sheets API open across appends and refreshes the token on 401.
+        authed_http = AuthorizedHttp(creds, http=httplib2.Http(timeout=SHEETS_HTTP_TIMEOUT))
+        self.service = build("sheets", "v4", http=authed_http, cache_discovery=False)
 
     def append_receipt(self, data: dict, sheet_name="Sheet1"):
         """
@@ -148,33 +442,56 @@ class SheetsTool:
             - If the first line is negative (no previous row), it will remain as-is.
         """
 
-        if not self.service:
-            self.auth()
+        return self.append_receipts([data], sheet_name)
 
-        values = []
+    @staticmethod
+    def receipt_rows(data: dict) -> list[list]:
+        """Flatten a structured receipt into [date, vendor, item, price, category] rows."""
         vendor = data.get("vendor", "")
         date = data.get("date", "")
-        for li in data.get("line_items", []):
-            values.append([
-                            date,
-                            vendor,
-                            li.get("item", ""),
-                            li.get("price", ""),
-                            li.get("category", "")
-])
+        return [
+            [
+                date,
+                vendor,
+                li.get("item", ""),
+                li.get("price", ""),
+                li.get("category", "")
+            ]
+            for li in data.get("line_items", [])
+        ]
+
+    def append_receipts(self, data_list: list[dict], sheet_name="Sheet1"):
+        """
+        Append several receipts into Google Sheet with a single API request.
+
+        Args:
+            data_list (list[dict]): Receipts in the structured form accepted by `append_receipt`.
+            sheet_name (str): Target Google Sheet tab name.
+
+        Notes:
+            - Rows from all receipts are concatenated in order and sent in one
+              `values().append` call, instead of one HTTPS request per receipt.
+        """
+
+        values = [row for data in data_list for row in self.receipt_rows(data)]
 
         body = {"values": values}
 
-        self.service.spreadsheets().values().append(
-            spreadsheetId=SPREADSHEET_ID,
-            range=f"{sheet_name}!A:D",
-            valueInputOption="USER_ENTERED",
-            insertDataOption="INSERT_ROWS",
-            body=body,
-        ).execute()
+        with self._lock:
+            if not self.service:
+                self.auth()
+
+            self.service.spreadsheets().values().append(
+                spreadsheetId=SPREADSHEET_ID,
+                range=f"{sheet_name}!A:D",
+                valueInputOption="USER_ENTERED",
+                insertDataOption="INSERT_ROWS",
+                body=body,
+            ).execute()
 
-        return {"status": "success", "rows_added": len(values)}
+        return {"status": "success", "receipts_added": len(data_list), "rows_added": len(values)}
 
+# Module-level singleton so the authorized connection persists across MCP calls.
 sheets_tool = SheetsTool()
 # ===================================================
 # TOOLS
@@ -193,20 +510,42 @@ async def extract_receipt_text(image_path: str) -> str:
         }
 
     Notes:
+        - The image is preprocessed locally (deskew + binarize) before OCR;
+          if OpenCV cannot decode it, the original bytes are sent instead.
         - OCR is performed by Gemini (`model.generate_content`).
         - Output is flattened into a single string, preserving line breaks.
         - If no text is detected, "raw_text" will be an empty string.
+        - Results are cached by image content (SHA-256) under the workspace,
+          so re-uploading the same receipt skips the Gemini call.
         - On error, returns {"error": "..."} with details.
     """
     try:
-        image_b64 = load_image_as_base64(image_path)
-        response = model.generate_content([
-            {"mime_type": "image/jpeg", "data": image_b64},
-            {"text": "Extract all text from this receipt."}
-        ])
-        return json.dumps({"raw_text": parse_response(response)}, indent=2)
+        digest = await asyncio.to_thread(file_sha256, image_path)
+        return await ocr_with_cache(digest, lambda: load_image_part(image_path))
     except Exception as e:
-        return json.dumps({"error": str(e)})
+        return orjson.dumps({"error": str(e)}).decode()
+
+@mcp.tool()
+async def extract_receipt_text_batch(image_paths: list[str]) -> str:
+    """
+    Extract raw text from several receipt images concurrently using Gemini OCR.
+
+    Args:
+        image_paths (list[str]): Local paths to the receipt images (JPEG/PNG).
+
+    Returns:
+        str (JSON): list of {"image_path": <path>, "raw_text": ...} or
+        {"image_path": <path>, "error": ...}, in the same order as `image_paths`.
+
+    Notes:
+        - Each image is processed as in `extract_receipt_text`; the Gemini calls
+          run in parallel, so the batch takes about as long as the slowest image.
+    """
+    results = await asyncio.gather(*[extract_receipt_text(p) for p in image_paths])
+    return orjson.dumps(
+        [{"image_path": p, **orjson.loads(r)} for p, r in zip(image_paths, results)],
+        option=orjson.OPT_INDENT_2
+    ).decode()
 
 @mcp.tool()
 async def structure_receipt_text(raw_text: str) -> str:
@@ -226,25 +565,97 @@ Return valid JSON with exactly these keys:
 Do not include any other fields.
     """
     try:
-        categories = load_categories()
-        response = model.generate_content(f"""
-        Here is a receipt OCR text:
-
-        {raw_text}
-
-        I have the following spending categories:
-        {categories}
-
-        For each line item, classify it into the most appropriate category.
-        Return JSON with:
-        - vendor
-        - date
-        - total_amount
-        - line_items: list of objects with 'item', 'price', 'category'
-        """)
-        return parse_response(response)
+        return await asyncio.to_thread(
+            structure_with_categories, raw_text, tuple(load_categories())
+        )
+    except Exception as e:
+        return orjson.dumps({"error": str(e)}).decode()
+
+@mcp.tool()
+async def structure_receipt_text_batch(raw_texts: list[str]) -> str:
+    """
+    Structure and categorize several receipt OCR texts concurrently.
+
+    Args:
+        raw_texts (list[str]): Raw OCR texts, e.g. the "raw_text" values returned
+            by `extract_receipt_text_batch`.
+
+    Returns:
+        str (JSON): list of structured receipts (same format as
+        `structure_receipt_text`) or {"error": ...} entries, in input order.
+
+    Notes:
+        - Categories are loaded once for the whole batch.
+        - The Gemini calls run in parallel, so the batch takes about as long
+          as the slowest receipt.
+    """
+    try:
+        categories = tuple(load_categories())
+    except Exception as e:
+        return orjson.dumps({"error": str(e)}).decode()
+
+    async def structure_one(raw_text: str):
+        try:
+            result = await asyncio.to_thread(structure_with_categories, raw_text, categories)
+            return orjson.loads(result)
+        except Exception as e:
+            return {"error": str(e)}
+
+    results = await asyncio.gather(*[structure_one(t) for t in raw_texts])
+    return orjson.dumps(results, option=orjson.OPT_INDENT_2).decode()
+
+@mcp.tool()
+async def extract_and_structure(image_path: str) -> str:
+    """
+    OCR, structure and categorize a receipt image in a single Gemini call.
+
+    Args:
+        image_path (str): Local path to the receipt image (JPEG/PNG).
+
+    Returns:
+        str (JSON): {
+            "vendor": ..., "date": ..., "total_amount": ...,
+            "line_items": [{"item": ..., "price": ..., "category": ...}]
+        }
+        Ready to be passed to `append_to_sheet`.
+
+    Notes:
+        - Replaces `extract_receipt_text` + `structure_receipt_text` with one
+          multimodal request, so the raw OCR text never round-trips through the agent.
+        - Gemini's JSON mode is constrained to the `Receipt` schema, so the result is valid JSON.
+        - Results are cached by image content (SHA-256) and categories, so
+          re-uploading the same receipt skips the Gemini call.
+        - On error, returns {"error": "..."} with details.
+    """
+    try:
+        digest = await asyncio.to_thread(file_sha256, image_path)
+        return await structure_image_with_cache(digest, lambda: load_image_part(image_path))
+    except Exception as e:
+        return orjson.dumps({"error": str(e)}).decode()
+
+@mcp.tool()
+async def extract_and_structure_bytes(image_b64: str) -> str:
+    """
+    OCR, structure and categorize a Base64-encoded receipt image in a single Gemini call.
+
+    Args:
+        image_b64 (str): Base64-encoded image contents (JPEG/PNG).
+
+    Returns:
+        str (JSON): same format as `extract_and_structure`.
+
+    Notes:
+        - Same as `extract_and_structure`, but for clients that hold the image
+          in memory; nothing is written to or read from a temporary file.
+        - Shares the content-hash cache with `extract_and_structure`.
+        - On error, returns {"error": "..."} with details.
+    """
+    try:
+        data = base64.b64decode(image_b64)
+        digest = hashlib.sha256(data).hexdigest()
+        return await structure_image_with_cache(digest, lambda: load_image_bytes_part(data))
     except Exception as e:
-        return json.dumps({"error": str(e)})
+        return orjson.dumps({"error": str(e)}).decode()
 
 
 @mcp.tool()
@@ -255,48 +666,70 @@ async def append_to_sheet(structured_json: str) -> str:
     {
       "vendor": "...",
       "date": "...",
+      "total_amount": ...,
       "line_items": [
         {"item": "...", "price": ..., "category": "..."}
       ]
     }
     """
     try:
-        # Step 1: Parse JSON
-        data = json.loads(structured_json)
-
-        # Step 2: Validate keys
-        expected_keys = {"vendor", "date", "line_items"}
-        if not all(k in data for k in expected_keys):
-            return json.dumps(
-                {"error": f"Invalid JSON: missing required keys {expected_keys}", "raw": data},
-                indent=2
-            )
-
-        if not isinstance(data["line_items"], list):
-            return json.dumps({"error": "line_items must be a list", "raw": data}, indent=2)
-
-        for li in data["line_items"]:
-            if not {"item", "price", "category"} <= li.keys():
-                return json.dumps(
-                    {"error": f"Invalid line_item format {li}. Must include item, price, and category.",
-                     "raw": data},
-                    indent=2
-                )
+        # Parse and validate against the same schema Gemini was asked to follow
+        receipt = Receipt.model_validate_json(structured_json)
+        # Sheets calls (and a first-use OAuth flow) block, so keep them off the event loop
+        result = await asyncio.to_thread(sheets_tool.append_receipt, receipt.model_dump())
+        return orjson.dumps(result, option=orjson.OPT_INDENT_2).decode()
+
+    except ValidationError as e:
+        return orjson.dumps(
+            {"error": f"Invalid receipt JSON: {e}", "raw": structured_json},
+            option=orjson.OPT_INDENT_2
+        ).decode()
+    except Exception as e:
+        return orjson.dumps(
+            {"error": str(e), "raw": structured_json},
+            option=orjson.OPT_INDENT_2
+        ).decode()
 
-        # Step 3: Append to sheet (with category column)
-        result = sheets_tool.append_receipt(data)
-        return json.dumps(result, indent=2)
+@mcp.tool()
+async def append_to_sheet_batch(structured_jsons: list[str]) -> str:
+    """
+    Append several structured receipts into Google Sheets with one Sheets API call.
+
+    Args:
+        structured_jsons (list[str]): Receipt JSON strings, each in the format
+            expected by `append_to_sheet`.
+
+    Returns:
+        str (JSON): {"status": "success", "receipts_added": ..., "rows_added": ...}
+
+    Notes:
+        - Every receipt is validated first; if any is invalid, nothing is appended
+          and {"error": ..., "index": <position>, "raw": ...} is returned.
+        - An empty list is a no-op and makes no Sheets API call.
+    """
+    if not structured_jsons:
+        return orjson.dumps(
+            {"status": "success", "receipts_added": 0, "rows_added": 0},
+            option=orjson.OPT_INDENT_2
+        ).decode()
+
+    receipts = []
+    for index, structured_json in enumerate(structured_jsons):
+        try:
+            receipts.append(Receipt.model_validate_json(structured_json))
+        except ValidationError as e:
+            return orjson.dumps(
+                {"error": f"Invalid receipt JSON: {e}", "index": index, "raw": structured_json},
+                option=orjson.OPT_INDENT_2
+            ).decode()
 
-    except json.JSONDecodeError:
-        return json.dumps(
-            {"error": "Invalid JSON received from LLM", "raw": structured_json},
-            indent=2
+    try:
+        result = await asyncio.to_thread(
+            sheets_tool.append_receipts, [r.model_dump() for r in receipts]
         )
+        return orjson.dumps(result, option=orjson.OPT_INDENT_2).decode()
     except Exception as e:
-        return json.dumps(
-            {"error": str(e), "raw": structured_json},
-            indent=2
-        )
+        return orjson.dumps({"error": str(e)}, option=orjson.OPT_INDENT_2).decode()
 
 
 @mcp.tool()
@@ -322,11 +755,11 @@ async def add_category(new_category: str) -> str:
         if new_category not in categories:
             categories.append(new_category)
             save_categories(categories)
-            return json.dumps({"status": "added", "categories": categories}, indent=2)
+            return orjson.dumps({"status": "added", "categories": categories}, option=orjson.OPT_INDENT_2).decode()
         else:
-            return json.dumps({"status": "exists", "categories": categories}, indent=2)
+            return orjson.dumps({"status": "exists", "categories": categories}, option=orjson.OPT_INDENT_2).decode()
     except Exception as e:
-        return json.dumps({"error": str(e)})
+        return orjson.dumps({"error": str(e)}).decode()
 
 @mcp.tool()
 async def remove_category(category: str) -> str:
@@ -350,11 +783,67 @@ async def remove_category(category: str) -> str:
         if category in categories:
             categories.remove(category)
             save_categories(categories)
-            return json.dumps({"status": "removed", "categories": categories}, indent=2)
+            return orjson.dumps({"status": "removed", "categories": categories}, option=orjson.OPT_INDENT_2).decode()
         else:
-            return json.dumps({"status": "not_found", "categories": categories}, indent=2)
+            return orjson.dumps({"status": "not_found", "categories": categories}, option=orjson.OPT_INDENT_2).decode()
     except Exception as e:
-        return json.dumps({"error": str(e)})
+        return orjson.dumps({"error": str(e)}).decode()
+
+# Tools that can be dispatched through `batch`.
+BATCH_TOOLS = {
+    "extract_receipt_text": extract_receipt_text,
+    "extract_receipt_text_batch": extract_receipt_text_batch,
+    "structure_receipt_text": structure_receipt_text,
+    "structure_receipt_text_batch": structure_receipt_text_batch,
+    "extract_and_structure": extract_and_structure,
+    "append_to_sheet": append_to_sheet,
+    "append_to_sheet_batch": append_to_sheet_batch,
+    "add_category": add_category,
+    "remove_category": remove_category,
+}
+
+class Invocation(BaseModel):
+    # Arguments are a JSON string rather than an object: Gemini rejects
+    # function declarations containing an OBJECT with no properties.
+    tool_name: str
+    arguments_json: str = "{}"
+
+async def dispatch(invocation: Invocation) -> dict:
+    tool_name = invocation.tool_name
+    tool = BATCH_TOOLS.get(tool_name)
+    if tool is None:
+        return {"tool_name": tool_name, "error": f"Unknown tool: {tool_name}"}
+    try:
+        result = await tool(**orjson.loads(invocation.arguments_json))
+        return {"tool_name": tool_name, "result": result}
+    except Exception as e:
+        return {"tool_name": tool_name, "error": str(e)}
+
+@mcp.tool()
+async def batch(invocations: list[Invocation]) -> str:
+    """
+    Run several independent tool calls concurrently.
+
+    Args:
+        invocations (list[Invocation]): Calls to run, each of the form
+            {"tool_name": "<tool>", "arguments_json": "<JSON object of the tool's arguments>"}, e.g.
+            [
+              {"tool_name": "extract_receipt_text", "arguments_json": "{\\"image_path\\": \\"a.jpg\\"}"},
+              {"tool_name": "extract_receipt_text", "arguments_json": "{\\"image_path\\": \\"b.jpg\\"}"}
+            ]
+
+    Returns:
+        str (JSON): list of {"tool_name": ..., "result": <tool output>} or
+        {"tool_name": ..., "error": "..."}, in the same order as `invocations`.
+
+    Notes:
+        - Only use this for calls that do not depend on each other's output.
+        - Supported tools: extract_receipt_text, extract_receipt_text_batch,
+          structure_receipt_text, structure_receipt_text_batch, extract_and_structure,
+          append_to_sheet, append_to_sheet_batch, add_category, remove_category.
+    """
+    results = await asyncio.gather(*[dispatch(inv) for inv in invocations])
+    return orjson.dumps(results, option=orjson.OPT_INDENT_2).decode()
 # =================================================
 # MAIN
 # ================================================
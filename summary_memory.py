@@ -0,0 +1,105 @@
+# summary_memory.py
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+
+SUMMARY_INSTRUCTION = (
+    "Summarize the conversation so far concisely, preserving vendor/date/total facts; "
+    "<=200 tokens."
+)
+COMPRESS_INSTRUCTION = "Compress to <=200 tokens, keep facts.\n\n{summary}"
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate token count as ~4 characters per token, without calling the LLM tokenizer."""
+    return max(1, len(text) // 4)
+
+
+def retrieve(query: str, messages: list[BaseMessage], n: int = 8) -> list[BaseMessage]:
+    """
+    Recency-based retrieval: keep every SystemMessage plus the `n` most recent messages.
+
+    Args:
+        query (str): The incoming user query (unused by the recency strategy).
+        messages (list[BaseMessage]): Full history, e.g. from `load_memory_variables`.
+        n (int): Number of most recent messages to keep.
+
+    Returns:
+        list[BaseMessage]: System messages (including the moving summary) followed
+        by the last `n` messages, in their original order.
+    """
+    older, recent = messages[:-n], messages[-n:]
+    return [m for m in older if isinstance(m, SystemMessage)] + recent
+
+
+class ReceiptSummaryMemory(ConversationSummaryBufferMemory):
+    """
+    ConversationSummaryBufferMemory that never summarizes SystemMessages away.
+
+    When the non-system messages exceed `max_token_limit`, the oldest of them
+    are pruned into the moving summary, while system prompts stay verbatim in
+    the buffer. System prompts can never be pruned, so they do not count
+    toward the limit.
+
+    Summaries are produced by appending a short instruction to the messages
+    the agent has already seen (previous summary, system prompts, pruned
+    turns), so the request shares its prefix with earlier prompts and can hit
+    Gemini's implicit context cache. Summaries longer than
+    `max_summary_tokens` are compressed once more so the moving summary
+    cannot grow without bound over long chats.
+
+    Token counts use a local chars/4 estimate instead of the LLM's
+    `get_num_tokens`, which for Gemini is a remote `count_tokens` call.
+    """
+
+    max_summary_tokens: int = 300
+
+    def _count_tokens(self, messages: list[BaseMessage]) -> int:
+        return sum(
+            estimate_tokens(str(m.content)) + len(str(m.additional_kwargs)) // 4
+            for m in messages
+        )
+
+    def _count_prunable_tokens(self, messages: list[BaseMessage]) -> int:
+        return self._count_tokens([m for m in messages if not isinstance(m, SystemMessage)])
+
+    def prune(self) -> None:
+        buffer = self.chat_memory.messages
+        curr_buffer_length = self._count_prunable_tokens(buffer)
+        if curr_buffer_length <= self.max_token_limit:
+            return
+
+        pruned_memory = []
+        while curr_buffer_length > self.max_token_limit:
+            idx = next(
+                (i for i, m in enumerate(buffer) if not isinstance(m, SystemMessage)),
+                None,
+            )
+            if idx is None:
+                break
+            pruned_memory.append(buffer.pop(idx))
+            curr_buffer_length = self._count_prunable_tokens(buffer)
+
+        if pruned_memory:
+            self.moving_summary_buffer = self.predict_new_summary(
+                pruned_memory, self.moving_summary_buffer
+            )
+
+    def predict_new_summary(
+        self, messages: list[BaseMessage], existing_summary: str
+    ) -> str:
+        prompt = []
+        if existing_summary:
+            prompt.append(self.summary_message_cls(content=existing_summary))
+        prompt.extend(m for m in self.chat_memory.messages if isinstance(m, SystemMessage))
+        prompt.extend(messages)
+        prompt.append(HumanMessage(content=SUMMARY_INSTRUCTION))
+        summary = str(self.llm.invoke(prompt).content)
+        return self._cap_summary(summary)
+
+    def _cap_summary(self, summary: str) -> str:
+        if estimate_tokens(summary) <= self.max_summary_tokens:
+            return summary
+        response = self.llm.invoke(
+            [HumanMessage(content=COMPRESS_INSTRUCTION.format(summary=summary))]
+        )
+        return str(response.content)